@@ -12,34 +12,48 @@ R: Restart the game
 
 Created by Marcus Croucher in 2018.
 """
+import atexit
 import logging
+import queue
 from collections import deque, namedtuple
+from logging.handlers import QueueHandler, QueueListener
 
 import pyxel
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
 SCALING_RATIO = 4
 
 
-@dataclass
+@dataclass(slots=True, frozen=True, eq=False)
 class Point:
+    """Grid coordinates, plus the matching screen coordinates for drawing."""
+
     x: int
     y: int
-
-    @property
-    def draw_x(self):
-        return self.x * SCALING_RATIO
-
-    @property
-    def draw_y(self):
-        return self.y * SCALING_RATIO
+    # Position in CELLS (and any other per-cell table); also the hash, which makes it
+    # dense and collision-free for every cell of the grid
+    idx: int = field(init=False)
+    # Screen coordinates, scaled once here instead of on every draw call
+    draw_x: int = field(init=False)
+    draw_y: int = field(init=False)
+
+    def __post_init__(self):
+        # Frozen dataclasses have to bypass their own __setattr__ to fill in derived fields
+        object.__setattr__(self, 'idx', (self.y + 1) * GRID_WIDTH + self.x + 1)
+        object.__setattr__(self, 'draw_x', self.x * SCALING_RATIO)
+        object.__setattr__(self, 'draw_y', self.y * SCALING_RATIO)
 
     def __repr__(self):
         return f"Point({self.x}, {self.y}))"
 
     def __hash__(self):
-        return 1000 * self.x + self.y
+        return self.idx
+
+    def __eq__(self, other):
+        if not isinstance(other, Point):
+            return NotImplemented
+        return self.idx == other.idx and self.x == other.x and self.y == other.y
 
 
 # Point = namedtuple("Point", ["x", "y"])  # Convenience class for coordinates
@@ -69,12 +83,73 @@ DRAW_HEIGHT = SCALING_RATIO * HEIGHT
 HEIGHT_SCORE = pyxel.FONT_HEIGHT
 HEIGHT_CONTROLS = HEIGHT_SCORE * 2
 
+# The head can step one cell past the playing field before it wraps around
+# (or dies on the walls), so the grid has a one-cell border on every side.
+GRID_WIDTH = WIDTH + 2
+GRID_HEIGHT = HEIGHT + 2
+
+# On-screen control buttons: two rows of three columns below the playing field
+BUTTON_WIDTH = DRAW_WIDTH // 3 - 2
+BUTTON_HEIGHT = HEIGHT_CONTROLS * SCALING_RATIO // 2 - 1
+UPPER_ROW = DRAW_HEIGHT + 1 - HEIGHT_CONTROLS * SCALING_RATIO
+LOWER_ROW = DRAW_HEIGHT + 1 - HEIGHT_CONTROLS * SCALING_RATIO // 2
+LEFT_COLUMN = 2
+MIDDLE_COLUMN = DRAW_WIDTH // 3 + 1
+RIGHT_COLUMN = 2 * DRAW_WIDTH // 3
+
+# Button in each [row][column] of the control grid; the upper corners are empty.
+# Rows are BUTTON_HEIGHT + 1 pixels apart and columns BUTTON_WIDTH + 1.
+HITBOX_GRID = ((None, 'up', None), ('left', 'down', 'right'))
+
+
+def button_text_position(text, button_x, button_y):
+    """Return the (x, y) at which text is centred on a control button."""
+    return (button_x + (BUTTON_WIDTH - len(text) * pyxel.FONT_WIDTH) // 2,
+            button_y + (BUTTON_HEIGHT - pyxel.FONT_HEIGHT) // 2)
+
+
+# (x, y, text, text position, button) for each control button, in drawing order
+CONTROL_BUTTONS = tuple(
+    (x, y, text, button_text_position(text, x, y), key)
+    for x, y, text, key in (
+        (MIDDLE_COLUMN, UPPER_ROW, 'UP', 'up'),
+        (MIDDLE_COLUMN, LOWER_ROW, 'DOWN', 'down'),
+        (LEFT_COLUMN, LOWER_ROW, 'LEFT', 'left'),
+        (RIGHT_COLUMN, LOWER_ROW, 'RIGHT', 'right'),
+    )
+)
+# The game over screen's restart button sits where UP normally is
+RESTART_BUTTON = (MIDDLE_COLUMN, UPPER_ROW, TEXT_DEATH[-1],
+                  button_text_position(TEXT_DEATH[-1], MIDDLE_COLUMN, UPPER_ROW), 'up')
+
 UP = Point(0, -1)
 DOWN = Point(0, 1)
 RIGHT = Point(1, 0)
 LEFT = Point(-1, 0)
 
-START = Point(5, 5 + HEIGHT_SCORE)
+OPPOSITE = {UP: DOWN, DOWN: UP, LEFT: RIGHT, RIGHT: LEFT}
+
+# Direction for each on-screen control button
+BUTTON_DIRECTIONS = {'up': UP, 'down': DOWN, 'left': LEFT, 'right': RIGHT}
+
+# (direction, (key, gamepad button)), in the order they take precedence
+DIRECTION_KEYS = (
+    (UP, (pyxel.KEY_UP, pyxel.GAMEPAD1_BUTTON_DPAD_UP)),
+    (DOWN, (pyxel.KEY_DOWN, pyxel.GAMEPAD1_BUTTON_DPAD_DOWN)),
+    (LEFT, (pyxel.KEY_LEFT, pyxel.GAMEPAD1_BUTTON_DPAD_LEFT)),
+    (RIGHT, (pyxel.KEY_RIGHT, pyxel.GAMEPAD1_BUTTON_DPAD_RIGHT)),
+)
+
+# One shared Point per grid cell, so moving the snake never allocates
+CELLS = [Point(x, y) for y in range(-1, HEIGHT + 1) for x in range(-1, WIDTH + 1)]
+
+
+def cell(x, y):
+    """Return the shared Point for the given grid coordinates."""
+    return CELLS[(y + 1) * GRID_WIDTH + x + 1]
+
+
+START = cell(5, 5 + HEIGHT_SCORE)
 
 SCORE_SPEED = {
     0: 18,
@@ -99,28 +174,33 @@ MAX_TIME_BONUS = 300
 MAX_SECONDS_PER_POINT = 3
 COLLISION_WITH_WALLS = False
 
+# Frames between snake steps for each speed. Steps happen on a fixed timestep:
+# every frame adds len(frames) of progress and a step costs sum(frames), so the
+# steps are spread evenly at the average of these frame counts.
 SPEED_TO_FRAME_MAPPING = {
-    20: [8, 7, 7],
-    19: [7, 7, 7],
-    18: [7, 7, 6],
-    17: [7, 6, 6],
-    16: [6, 6, 6],
-    15: [6, 6, 5],
-    14: [6, 5, 5],
-    13: [5, 5, 5],
-    12: [5, 5, 4],
-    11: [5, 4, 4],
-    10: [4, 4, 4],
-    9: [4, 4, 3],
-    8: [4, 3, 3],
-    7: [3, 3, 3],
-    6: [3, 3, 2],
-    5: [3, 2, 2],
-    4: [2, 2, 2],
-    3: [2, 2, 1],
-    2: [2, 1, 1],
-    1: [1, 1, 1]
+    20: (8, 7, 7),
+    19: (7, 7, 7),
+    18: (7, 7, 6),
+    17: (7, 6, 6),
+    16: (6, 6, 6),
+    15: (6, 6, 5),
+    14: (6, 5, 5),
+    13: (5, 5, 5),
+    12: (5, 5, 4),
+    11: (5, 4, 4),
+    10: (4, 4, 4),
+    9: (4, 4, 3),
+    8: (4, 3, 3),
+    7: (3, 3, 3),
+    6: (3, 3, 2),
+    5: (3, 2, 2),
+    4: (2, 2, 2),
+    3: (2, 2, 1),
+    2: (2, 1, 1),
+    1: (1, 1, 1)
 }
+# (progress per frame, progress per step) for each speed, so step_due doesn't redo it every frame
+SPEED_TO_STEP = {speed: (len(frames), sum(frames)) for speed, frames in SPEED_TO_FRAME_MAPPING.items()}
 
 
 ###################
@@ -138,8 +218,40 @@ def define_colors():
     # pyxel.colors[COL_PINK] = 0xc43486
 
 
-logging.basicConfig(filename='snake_game.log', level=logging.INFO,
+def next_cell(point, direction, wall_collision):
+    """Return the cell the head moves to from point, or None if that leaves the grid."""
+    x = point.x + direction.x
+    y = point.y + direction.y
+
+    if wall_collision is False:
+        if point.x < 0:
+            x = WIDTH - 1
+        elif point.x >= WIDTH:
+            x = 0
+        elif point.y < HEIGHT_SCORE:
+            y = HEIGHT - HEIGHT_CONTROLS - 1
+        elif point.y >= HEIGHT - HEIGHT_CONTROLS:
+            y = HEIGHT_SCORE
+
+    if -1 <= x <= WIDTH and -1 <= y <= HEIGHT:
+        return cell(x, y)
+    return None
+
+
+def build_moves(wall_collision):
+    """Precompute next_cell for every cell and direction, indexed by direction and Point.idx."""
+    return {direction: [next_cell(point, direction, wall_collision) for point in CELLS]
+            for direction in (UP, DOWN, LEFT, RIGHT)}
+
+
+# The game only formats log records and puts them on a queue; a background thread writes
+# them to the file, so the game loop never waits on disk.
+log_queue = queue.SimpleQueue()
+log_listener = QueueListener(log_queue, logging.FileHandler('snake_game.log'))
+logging.basicConfig(handlers=[QueueHandler(log_queue)], level=logging.INFO,
                     format='%(asctime)s - %(levelname)s - %(message)s')
+log_listener.start()
+atexit.register(log_listener.stop)  # Flush whatever is still queued when the game quits
 
 class Snake:
     """The class that sets up and runs the game."""
@@ -154,6 +266,9 @@ class Snake:
         define_colors()
         define_sound_and_music()
         self.wall_collision = COLLISION_WITH_WALLS
+        self.moves = build_moves(self.wall_collision)
+        # The snake is painted here as it moves and copied to the screen in one blt per frame
+        self.snake_layer = pyxel.Image(DRAW_WIDTH, DRAW_HEIGHT)
         self.reset()
 
         pyxel.mouse(visible=True)
@@ -168,6 +283,10 @@ class Snake:
         self.popped_point_2 = None
         self.snake = deque()
         self.snake.append(START)
+        self.occupancy = bytearray(GRID_WIDTH * GRID_HEIGHT)  # Snake segments on each cell, by Point.idx
+        self.occupancy[START.idx] = 1
+        self.snake_layer.cls(COL_BLACK)
+        self.paint_segment(START, pyxel.COLOR_GREEN)
         self.apple = None
         self.death = False
         self.melons = 0
@@ -175,16 +294,17 @@ class Snake:
         self.score = 0
         self.time_bonus = 0
         self.last_eaten_frame = 0
+        self.update_score_text()
         self.generate_fruit()
         self.speed = DEFAULT_SPEED
-        self.speed_frames = deque(SPEED_TO_FRAME_MAPPING[self.speed])
-        self.current_frame_speed = self.speed_frames[0]
+        self.step_gain, self.step_cost = SPEED_TO_STEP[self.speed]
+        self.step_progress = 0  # Progress towards the next step, see SPEED_TO_FRAME_MAPPING
         self.frame_count = 0
-        self.last_update_before = 0
         self.mouse_pressed_button = None
+        self.highlighted_button = None  # Drawn in pressed_col until the mouse button is released
         self.debug_mode = False
         self.last_inputs = deque(maxlen=10)  # Store last 10 inputs for debugging
-        self.frame_history = deque(maxlen=60)  # Store last 60 frames of snake positions
+        self.frame_history = deque(maxlen=60)  # Store last 60 snake head positions
         logging.info("Game initialized")
 
         pyxel.playm(0, loop=True)
@@ -192,29 +312,33 @@ class Snake:
     ##############
     # Game logic #
     ##############
-    def rotate_speed(self):
-        self.speed_frames.rotate()
-        self.current_frame_speed = self.speed_frames[0]
-        self.last_update_before = 0
+    def step_due(self):
+        """Advance the fixed timestep by one frame and return whether the snake should move."""
+        self.step_progress += self.step_gain
+        if self.step_progress >= self.step_cost:
+            self.step_progress -= self.step_cost
+            return True
+        return False
 
     def update(self):
         self.frame_count += 1
-        self.last_update_before += 1
 
         if pyxel.btnp(pyxel.MOUSE_BUTTON_LEFT):
             self.check_button_hitboxes()
+        elif not pyxel.btn(pyxel.MOUSE_BUTTON_LEFT):
+            self.highlighted_button = None
 
         if not self.death:
             self.update_direction()
-            if self.last_update_before == self.current_frame_speed:
-                self.rotate_speed()
+            if self.step_due():
                 self.update_snake()
                 self.check_death()
                 self.check_fruit()
 
-                # Log snake position every frame
-                self.frame_history.append(list(self.snake))
-                logging.debug(f"Frame {self.frame_count}: Snake positions: {list(self.snake)}")
+                # Record the head position once per snake step
+                self.frame_history.append(self.snake[0])
+                if logging.getLogger().isEnabledFor(logging.DEBUG):
+                    logging.debug("Frame %d: Snake positions: %s", self.frame_count, list(self.snake))
         else:
             if self.mouse_pressed_button == 'up':
                 self.reset()
@@ -234,122 +358,94 @@ class Snake:
             self.reset()
 
     def check_button_hitboxes(self):
-        x = pyxel.mouse_x
-        y = pyxel.mouse_y
-        button_height = HEIGHT_CONTROLS * SCALING_RATIO // 2 - 1
-        button_width = DRAW_WIDTH // 3 - 2
-
-        upper_row_high = DRAW_HEIGHT + 1 - HEIGHT_CONTROLS * SCALING_RATIO
-        upper_row_low = upper_row_high + button_height
-
-        lower_row_high = DRAW_HEIGHT + 1 - HEIGHT_CONTROLS * SCALING_RATIO // 2
-        lower_row_low = lower_row_high + button_height
-
-        first_col_left = 2
-        first_col_right = first_col_left + button_width
-
-        second_col_left = DRAW_WIDTH // 3 + 1
-        second_col_right = second_col_left + button_width
-
-        third_col_left = 2 * DRAW_WIDTH // 3
-        third_col_right = third_col_left + button_width
-
-        hitboxes = dict(
-            up=[upper_row_high, upper_row_low, second_col_left, second_col_right],
-            down=[lower_row_high, lower_row_low, second_col_left, second_col_right],
-            left=[lower_row_high, lower_row_low, first_col_left, first_col_right],
-            right=[lower_row_high, lower_row_low, third_col_left, third_col_right])
-        for key, hitbox in hitboxes.items():
-            if (hitbox[2] < x < hitbox[3]) & (hitbox[0] < y < hitbox[1]):
-                print(key)
+        row, y_offset = divmod(pyxel.mouse_y - UPPER_ROW, BUTTON_HEIGHT + 1)
+        col, x_offset = divmod(pyxel.mouse_x - LEFT_COLUMN, BUTTON_WIDTH + 1)
+        # An offset of 0 is the edge of a button, which does not count as inside it
+        if 0 <= row < 2 and 0 <= col < 3 and 0 < y_offset < BUTTON_HEIGHT and 0 < x_offset < BUTTON_WIDTH:
+            key = HITBOX_GRID[row][col]
+            if key is not None:
                 self.mouse_pressed_button = key
+                self.highlighted_button = key
 
         return None
 
     def update_direction(self):
         """Watch the keys and change direction."""
         previous_direction = self.direction
+        new_direction = None
         if self.mouse_pressed_button:
-            match self.mouse_pressed_button:
-                case 'up':
-                    if self.direction is not DOWN:
-                        self.direction = UP
-                case 'down':
-                    if self.direction is not UP:
-                        self.direction = DOWN
-                case 'left':
-                    if self.direction is not RIGHT:
-                        self.direction = LEFT
-                case 'right':
-                    if self.direction is not LEFT:
-                        self.direction = RIGHT
+            new_direction = BUTTON_DIRECTIONS[self.mouse_pressed_button]
             self.mouse_pressed_button = None
         else:
-            if pyxel.btn(pyxel.KEY_UP) or pyxel.btn(pyxel.GAMEPAD1_BUTTON_DPAD_UP):
-                if self.direction is not DOWN:
-                    self.direction = UP
-            elif pyxel.btn(pyxel.KEY_DOWN) or pyxel.btn(pyxel.GAMEPAD1_BUTTON_DPAD_DOWN):
-                if self.direction is not UP:
-                    self.direction = DOWN
-            elif pyxel.btn(pyxel.KEY_LEFT) or pyxel.btn(pyxel.GAMEPAD1_BUTTON_DPAD_LEFT):
-                if self.direction is not RIGHT:
-                    self.direction = LEFT
-            elif pyxel.btn(pyxel.KEY_RIGHT) or pyxel.btn(pyxel.GAMEPAD1_BUTTON_DPAD_RIGHT):
-                if self.direction is not LEFT:
-                    self.direction = RIGHT
+            btn = pyxel.btn
+            for direction, (key, gamepad_button) in DIRECTION_KEYS:
+                if btn(key) or btn(gamepad_button):
+                    new_direction = direction
+                    break
+
+        # The snake can't turn back on itself
+        if new_direction is not None and new_direction is not OPPOSITE[self.direction]:
+            self.direction = new_direction
 
         # Log direction changes
-        if self.direction != previous_direction:
+        if self.debug_mode and self.direction != previous_direction:
             logging.info(f"Direction changed from {previous_direction} to {self.direction}")
 
         # Store input for debugging
         self.last_inputs.append(self.direction)
 
     def get_new_snake_head(self):
-        old_head = self.snake[0]
-
-        if self.wall_collision is False:
-            if old_head.x < 0:
-                return Point(WIDTH - 1, old_head.y + self.direction.y)
-            elif old_head.x >= WIDTH:
-                return Point(0, old_head.y + self.direction.y)
-            elif old_head.y < HEIGHT_SCORE:
-                return Point(old_head.x + self.direction.x, HEIGHT - HEIGHT_CONTROLS - 1)
-            elif old_head.y >= HEIGHT - HEIGHT_CONTROLS:
-                return Point(old_head.x + self.direction.x, HEIGHT_SCORE)
-
-        return Point(old_head.x + self.direction.x, old_head.y + self.direction.y)
+        return self.moves[self.direction][self.snake[0].idx]
 
     def update_snake(self):
         """Move the snake based on the direction."""
         new_head = self.get_new_snake_head()
         self.snake.appendleft(new_head)
+        self.occupancy[new_head.idx] += 1
         self.popped_point_2 = self.popped_point_1
         self.popped_point_1 = self.popped_point
         self.popped_point = self.snake.pop()
+        self.occupancy[self.popped_point.idx] -= 1
+
+        if not self.occupancy[self.popped_point.idx]:
+            self.paint_segment(self.popped_point, COL_BLACK)
+        if len(self.snake) > 1:
+            self.paint_segment(self.snake[1], pyxel.COLOR_LIME)
+        self.paint_segment(new_head, pyxel.COLOR_GREEN)
+
+    def paint_segment(self, point, col):
+        """Paint a single cell of the snake layer."""
+        self.snake_layer.rect(point.draw_x, point.draw_y, SCALING_RATIO, SCALING_RATIO, col)
 
     def check_fruit(self):
-        if SCORE_SPEED.get(self.melons + self.apples) is not None:
+        if self.fruit_is_melon:
             self.check_melon()
         else:
             self.check_apple()
     def add_time_bonus(self):
         self.time_bonus += min(max(MAX_SECONDS_PER_POINT * 60 + self.last_eaten_frame - self.frame_count, 0), MAX_TIME_BONUS)
         self.last_eaten_frame = self.frame_count
-    def check_melon(self):
-        if {self.snake[0]}.intersection(set(self.melon)):
 
+    def update_score_text(self):
+        """Format the score shown at the top; only needed when the score changes."""
+        self.score_text = f"{self.score * 100 + self.time_bonus:04}"
+
+    def check_melon(self):
+        if self.snake[0] in self.melon_set:
             self.speed = SCORE_SPEED[self.melons + self.apples]
+            self.step_gain, self.step_cost = SPEED_TO_STEP[self.speed]
             self.melons += 1
             self.score += 3
 
             self.add_time_bonus()
+            self.update_score_text()
             self.generate_fruit()
-            self.snake.append(self.popped_point)
-            self.snake.append(self.popped_point_1)
-            self.snake.append(self.popped_point_2)
+            for point in (self.popped_point, self.popped_point_1, self.popped_point_2):
+                if point is not None:  # The snake may not have moved three times yet
+                    self.snake.append(point)
+                    self.occupancy[point.idx] += 1
+                    self.paint_segment(point, pyxel.COLOR_LIME)
 
-            self.speed_frames = deque(SPEED_TO_FRAME_MAPPING[self.speed])
             pyxel.play(0, 0)
 
     def check_apple(self):
@@ -359,39 +455,45 @@ class Snake:
             self.apples += 1
             self.score += 1
             self.add_time_bonus()
+            self.update_score_text()
             self.snake.append(self.popped_point)
+            self.occupancy[self.popped_point.idx] += 1
+            self.paint_segment(self.popped_point, pyxel.COLOR_LIME)
             self.generate_fruit()
 
             pyxel.play(0, 0)
 
     def generate_fruit(self):
-        if SCORE_SPEED.get(self.melons + self.apples) is not None:
+        self.fruit_is_melon = SCORE_SPEED.get(self.melons + self.apples) is not None
+        if self.fruit_is_melon:
             self.generate_melon()
         else:
             self.generate_apple()
 
     def generate_apple(self):
         """Generate an apple randomly."""
-        snake_pixels = set(self.snake)
-
         self.apple = self.snake[0]
-        while self.apple in snake_pixels:
+        while self.occupancy[self.apple.idx]:
             x = pyxel.rndi(0, WIDTH - 1)
             y = pyxel.rndi(HEIGHT_SCORE + 1, HEIGHT - HEIGHT_CONTROLS - 1)
-            self.apple = Point(x, y)
+            self.apple = cell(x, y)
 
     def melon_points(self, x, y):
-        return [Point(x, y), Point(x + 1, y), Point(x, y + 1), Point(x + 1, y + 1)]
+        return [cell(x, y), cell(x + 1, y), cell(x, y + 1), cell(x + 1, y + 1)]
 
     def generate_melon(self):
-        """Generate an apple randomly."""
-        snake_pixels = set(self.snake)
+        """Generate a melon randomly."""
+        occupancy = self.occupancy
 
-        self.melon = self.melon_points(self.snake[0].x, self.snake[0].y)
-        while set(self.melon).intersection(snake_pixels):
+        # Start on the head, which is always occupied, so at least one position is drawn.
+        # The four melon cells are idx, its right neighbour, and the two cells below.
+        idx = self.snake[0].idx
+        while occupancy[idx] or occupancy[idx + 1] or occupancy[idx + GRID_WIDTH] or occupancy[idx + GRID_WIDTH + 1]:
             x = pyxel.rndi(0, WIDTH - 2)
             y = pyxel.rndi(HEIGHT_SCORE + 2, HEIGHT - HEIGHT_CONTROLS - 2)
-            self.melon = self.melon_points(x, y)
+            idx = cell(x, y).idx
+        self.melon = self.melon_points(x, y)
+        self.melon_set = frozenset(self.melon)
 
     # def check_death(self):
     #     """Check whether the snake has died (out of bounds or doubled up.)"""
@@ -416,7 +518,7 @@ class Snake:
 
     def draw(self):
         if not self.death:
-            pyxel.cls(col=COL_BLACK)
+            # The snake layer covers the whole screen, so it also clears the last frame
             self.draw_snake()
             self.draw_score()
             self.draw_fruit()
@@ -429,7 +531,7 @@ class Snake:
             self.draw_death()
 
     def draw_fruit(self):
-        if SCORE_SPEED.get(self.melons + self.apples) is not None:
+        if self.fruit_is_melon:
             self.draw_melon()
         else:
             self.draw_apple()
@@ -450,22 +552,15 @@ class Snake:
         # pyxel.rect(self.melon[0].draw_x, self.melon[0].draw_y, w=SCALING_RATIO * 2, h=SCALING_RATIO * 2, col=COL_GREEN)
 
     def draw_snake(self):
-        """Draw the snake with a distinct head by iterating through deque."""
-
-        for i, point in enumerate(self.snake):
-            if i == 0:
-                colour = pyxel.COLOR_GREEN
-            else:
-                colour = pyxel.COLOR_LIME
+        """Draw the snake by copying its layer, which update_snake keeps up to date, to the screen."""
 
-            pyxel.rect(point.draw_x, point.draw_y, w=SCALING_RATIO, h=SCALING_RATIO, col=colour)
+        pyxel.blt(0, 0, self.snake_layer, 0, 0, DRAW_WIDTH, DRAW_HEIGHT)
 
     def draw_score(self):
         """Draw the score at the top."""
 
-        score = f"{self.score * 100 + self.time_bonus:04}"
         pyxel.rect(0, 0, DRAW_WIDTH, HEIGHT_SCORE * SCALING_RATIO, COL_MAGENTA)
-        pyxel.text(1, 1, score, COL_WHITE)
+        pyxel.text(1, 1, self.score_text, COL_WHITE)
 
     def draw_controls(self):
         """Draw the score at the top."""
@@ -475,65 +570,23 @@ class Snake:
                    w=DRAW_WIDTH,
                    h=HEIGHT_CONTROLS * SCALING_RATIO,
                    col=COL_MAGENTA)
-        button_width = DRAW_WIDTH // 3 - 2
-        button_height = HEIGHT_CONTROLS * SCALING_RATIO // 2 - 1
-        upper_row = DRAW_HEIGHT + 1 - HEIGHT_CONTROLS * SCALING_RATIO
-        lower_row = DRAW_HEIGHT + 1 - HEIGHT_CONTROLS * SCALING_RATIO // 2
-        button_color = pyxel.COLOR_WHITE
-        self.draw_button(DRAW_WIDTH // 3 + 1,
-                         y=upper_row,
-                         w=button_width,
-                         h=button_height,
-                         col=button_color, text='UP', text_col=COL_BLACK, pressed_col=COL_PINK)
-        self.draw_button(DRAW_WIDTH // 3 + 1,
-                         y=lower_row,
-                         w=button_width,
-                         h=button_height,
-                         col=button_color, text='DOWN', text_col=COL_BLACK, pressed_col=COL_PINK)
-        self.draw_button(2,
-                         y=lower_row,
-                         w=button_width,
-                         h=button_height,
-                         col=button_color, text='LEFT', text_col=COL_BLACK, pressed_col=COL_PINK)
-        self.draw_button(2 * DRAW_WIDTH // 3,
-                         y=lower_row,
-                         w=button_width,
-                         h=button_height,
-                         col=button_color, text='RIGHT', text_col=COL_BLACK, pressed_col=COL_PINK)
-
-    def draw_button(self, x, y, w, h, col, text, text_col, pressed_col):
-        if text.lower == self.mouse_pressed_button:
+        for button in CONTROL_BUTTONS:
+            self.draw_button(*button, col=pyxel.COLOR_WHITE, text_col=COL_BLACK, pressed_col=COL_PINK)
+
+    def draw_button(self, x, y, text, text_position, key, col, text_col, pressed_col):
+        if key == self.highlighted_button:
             col = pressed_col
-        pyxel.rect(x, y, w, h, col)
-        text_x = self.center_button_text(text, x, w)
-        text_y = self.center_button_text_vertically(y, h)
-        pyxel.text(text_x, text_y, text, text_col)
+        pyxel.rect(x, y, BUTTON_WIDTH, BUTTON_HEIGHT, col)
+        pyxel.text(*text_position, text, text_col)
 
     def draw_death(self):
         """Draw a blank screen with some text."""
 
         pyxel.cls(col=COL_WHITE)
-        display_text = TEXT_DEATH[:-1]
-        display_text.append(' ')
-        display_text.append('FRUIT')
-        display_text.append(f"{self.score * 100:04}")
-        display_text.append(' ')
-        display_text.append('TIME BONUS')
-        display_text.append(f'{self.time_bonus:04}')
-        display_text.append('-----')
-        display_text.append(f"{self.score * 100 + self.time_bonus:03}")
-        for i, text in enumerate(display_text):
-            y_offset = (pyxel.FONT_HEIGHT + 2) * i
-            text_x = self.center_text(text, DRAW_WIDTH)
-            pyxel.text(text_x, HEIGHT_DEATH + y_offset, text, COL_MAGENTA)
-
-        x = DRAW_WIDTH // 3 + 1
-        y = DRAW_HEIGHT + 1 - HEIGHT_CONTROLS * SCALING_RATIO
-        button_width = DRAW_WIDTH // 3 - 2
-        button_height = HEIGHT_CONTROLS * SCALING_RATIO // 2 - 1
-
-        self.draw_button(x, y, w=button_width, h=button_height, col=COL_BLACK, text=TEXT_DEATH[-1], text_col=COL_WHITE,
-                         pressed_col=COL_GREEN)
+        for text_x, text_y, text in self.death_text:
+            pyxel.text(text_x, text_y, text, COL_MAGENTA)
+
+        self.draw_button(*RESTART_BUTTON, col=COL_BLACK, text_col=COL_WHITE, pressed_col=COL_GREEN)
 
     @staticmethod
     def center_text(text, page_width, char_width=pyxel.FONT_WIDTH):
@@ -542,35 +595,38 @@ class Snake:
         text_width = len(text) * char_width
         return (page_width - text_width) // 2
 
-    @staticmethod
-    def center_button_text(text, button_x, button_width, char_width=pyxel.FONT_WIDTH):
-        """Helper function for calculating the start x value for centered text."""
-
-        text_width = len(text) * char_width
-
-        return button_x + (button_width - text_width) // 2
-
-    @staticmethod
-    def center_button_text_vertically(button_y, button_height, char_height=pyxel.FONT_HEIGHT):
-        """Helper function for calculating the start x value for centered text."""
-
-        return button_y + (button_height - char_height) // 2
-
     def check_death(self):
         head = self.snake[0]
         if self.wall_collision:
             if head.x < 0 or head.y < HEIGHT_SCORE or head.x >= WIDTH or head.y >= HEIGHT - HEIGHT_CONTROLS:
                 logging.warning(f"Death by wall collision at position {head}")
                 self.death_event()
-        if len(self.snake) != len(set(self.snake)):
+        if self.occupancy[head.idx] > 1:
             logging.warning(f"Death by self-collision at position {head}")
             self.death_event()
 
     def death_event(self):
         self.death = True
+        # The final score can't change any more, so the game over text is laid out once here
+        lines = (
+            *TEXT_DEATH[:-1],
+            ' ',
+            'FRUIT',
+            f"{self.score * 100:04}",
+            ' ',
+            'TIME BONUS',
+            f'{self.time_bonus:04}',
+            '-----',
+            f"{self.score * 100 + self.time_bonus:03}",
+        )
+        self.death_text = tuple(
+            (self.center_text(text, DRAW_WIDTH), HEIGHT_DEATH + (pyxel.FONT_HEIGHT + 2) * i, text)
+            for i, text in enumerate(lines)
+        )
         logging.critical(f"Game over at frame {self.frame_count}")
         logging.info(f"Last 10 inputs: {list(self.last_inputs)}")
-        logging.info(f"Last 60 frames of snake positions: {list(self.frame_history)}")
+        logging.info(f"Last 60 snake head positions: {list(self.frame_history)}")
+        logging.info(f"Snake at death: {list(self.snake)}")
         pyxel.stop()
         pyxel.play(0, 1)
 